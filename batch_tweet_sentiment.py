@@ -0,0 +1,326 @@
+"""
+file - batch_tweet_sentiment.py
+Analyze archived tweet files (JSONL, optionally gzipped) in parallel and add to Elasticsearch
+"""
+
+import argparse
+import collections
+import glob
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk
+
+from parsing import ParsingUtils, LINK_STAGES
+
+from config import nltk_min_tokens, nltk_tokens_required, nltk_tokens_ignored
+from config import elasticsearch_host, elasticsearch_port
+from config import sentiment_url
+
+# per worker process instance of ParsingUtils, set up by init_worker
+worker_parsing_utils = None
+worker_link_sentiment = False
+
+
+def init_worker(tokens_required, tokens_ignored, min_tokens, web_sentiment, link_sentiment,
+                quiet=False, debug=False):
+    global worker_parsing_utils, worker_link_sentiment
+    worker_logger = logging.getLogger('stock-tweets-batch')
+    # keep per tweet filter messages out of the batch output
+    worker_logger.setLevel(logging.WARNING)
+    if debug:
+        worker_logger.setLevel(logging.DEBUG)
+    if quiet:
+        worker_logger.disabled = True
+    worker_parsing_utils = ParsingUtils(sentiment_url=sentiment_url, logger=worker_logger,
+                                        web_sentiment=web_sentiment,
+                                        tokens_required=tokens_required,
+                                        tokens_ignored=tokens_ignored,
+                                        min_tokens=min_tokens)
+    worker_link_sentiment = link_sentiment
+
+
+def process_chunk(lines):
+    """
+    run the tweet cleaning, filtering and sentiment analysis on a chunk of raw lines,
+    returns the docs to add to elasticsearch, the number of tweets read and the link stage counters
+    """
+    worker_parsing_utils.link_stats.clear()
+    docs = []
+    count = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            dict_data = json.loads(line)
+        except ValueError as e:
+            worker_parsing_utils.logger.warning('Exception: skipping malformed line caused by: %s' % e)
+            continue
+        # skip delete/limit notices and other non tweet records in the dumps
+        if not isinstance(dict_data, dict) or 'created_at' not in dict_data:
+            continue
+        count += 1
+        try:
+            doc = worker_parsing_utils.tweet_sentiment_analysis(dict_data, link_sentiment=worker_link_sentiment)
+        except Exception as e:
+            worker_parsing_utils.logger.warning('Exception: skipping malformed tweet caused by: %s' % e)
+            continue
+        if doc:
+            docs.append(doc)
+    return docs, count, worker_parsing_utils.link_stats.copy()
+
+
+def open_tweet_file(path):
+    # gzip aware open, always binary so offsets are in bytes
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_tweet_chunks(path, offset=0, chunk_size=1000):
+    """
+    generator streaming a tweet file in chunks of chunk_size lines starting at byte offset,
+    yields (lines, end_offset) where end_offset is the byte offset right after the chunk.
+    offsets of gzipped files are in uncompressed bytes
+    """
+    with open_tweet_file(path) as f:
+        if offset:
+            f.seek(offset)
+        lines = []
+        for line in f:
+            offset += len(line)
+            lines.append(line)
+            if len(lines) >= chunk_size:
+                yield lines, offset
+                lines = []
+        if lines:
+            yield lines, offset
+
+
+class Checkpoint:
+    """
+    Byte offset per file saved as json, so a killed job resumes where it stopped.
+    With restart the saved offsets are ignored and overwritten as the files are processed again
+    """
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.files = {}
+        if path and os.path.exists(path) and not restart:
+            with open(path) as f:
+                self.files = json.load(f)
+
+    def get_offset(self, filename):
+        return self.files.get(filename, {}).get('offset', 0)
+
+    def is_done(self, filename):
+        return self.files.get(filename, {}).get('done', False)
+
+    def update(self, filename, offset, done=False):
+        self.files[filename] = {'offset': offset, 'done': done}
+        if not self.path:
+            return
+        # write to a temp file first so a kill never leaves a truncated checkpoint
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.files, f)
+        os.replace(tmp_path, self.path)
+
+
+class BatchProgress:
+    """
+    Reports files and tweets per second
+    """
+    def __init__(self, total_files, interval=10):
+        self.total_files = total_files
+        self.interval = interval
+        self.files = 0
+        self.tweets = 0
+        self.indexed = 0
+        self.link_stats = collections.Counter()
+        self.start_time = time.time()
+        self.last_report = self.start_time
+
+    def add(self, tweets, indexed, link_stats):
+        self.tweets += tweets
+        self.indexed += indexed
+        self.link_stats.update(link_stats)
+        if time.time() - self.last_report >= self.interval:
+            self.report()
+
+    def file_done(self):
+        self.files += 1
+        self.report()
+
+    def report(self):
+        now = time.time()
+        self.last_report = now
+        elapsed = max(now - self.start_time, 1e-6)
+        logger.info('files: %d/%d (%.2f/s) | tweets: %d (%.1f/s) | indexed: %d' % (
+            self.files, self.total_files, self.files / elapsed,
+            self.tweets, self.tweets / elapsed, self.indexed))
+        if self.link_stats:
+            logger.info('links: %s' % ' | '.join('%s: %d' % (k, self.link_stats[k]) for k in LINK_STAGES))
+
+
+def bulk_index(docs):
+    # use tweet id as document id so tweets re-read after a resume are overwritten, not duplicated
+    actions = [{'_index': args.index, '_type': 'tweet', '_id': doc['tweet_id'], '_source': doc}
+               for doc in docs]
+    bulk(es, actions)
+
+
+def iter_file_chunks(filenames, checkpoint, chunk_size):
+    """
+    chunks of all files one after the other, resuming each file from its checkpointed offset,
+    yields (filename, lines, end_offset, is_last) where is_last marks the final chunk of a file.
+    files with nothing left to read yield a single empty last chunk so they still get marked done
+    """
+    for filename in filenames:
+        offset = checkpoint.get_offset(filename)
+        if offset:
+            logger.info('Resuming %s at byte offset %d' % (filename, offset))
+        else:
+            logger.info('Processing %s' % filename)
+
+        # hold back one chunk to know which one is the last of the file
+        prev = (filename, [], offset)
+        for lines, end_offset in read_tweet_chunks(filename, offset, chunk_size):
+            if prev[1]:
+                yield prev + (False,)
+            prev = (filename, lines, end_offset)
+        yield prev + (True,)
+
+
+def process_files(pool, filenames, checkpoint, progress):
+    # keep a bounded number of chunks in flight across file boundaries so the pool never
+    # drains between files. Results are consumed in order so the checkpointed offset
+    # never skips over an unfinished chunk
+    max_pending = args.processes * 2
+    pending = collections.deque()
+
+    def consume_oldest():
+        result, filename, end_offset, is_last = pending.popleft()
+        docs, count, link_stats = result.get()
+        if docs:
+            bulk_index(docs)
+        checkpoint.update(filename, end_offset, done=is_last)
+        progress.add(count, len(docs), link_stats)
+        if is_last:
+            progress.file_done()
+
+    for filename, lines, end_offset, is_last in iter_file_chunks(filenames, checkpoint, args.chunk_size):
+        pending.append((pool.apply_async(process_chunk, (lines,)), filename, end_offset, is_last))
+        if len(pending) >= max_pending:
+            consume_oldest()
+    while pending:
+        consume_oldest()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('files', nargs='+',
+                        help='Tweet files or glob patterns, one json tweet per line, .gz files are decompressed')
+    parser.add_argument('-i', '--index', default='stock-tweet', help='index name for elasticsearch')
+    parser.add_argument('-c', '--checkpoint', default='batch_checkpoint.json',
+                        help='Checkpoint file storing byte offsets per file to resume from')
+    parser.add_argument('-r', '--restart', action='store_true',
+                        help='Ignore the checkpoint and process all files from the start, '
+                        'e.g. after a config or model change')
+    parser.add_argument('-p', '--processes', type=int, default=multiprocessing.cpu_count(),
+                        help='Number of worker processes')
+    parser.add_argument('--chunk_size', type=int, default=1000, help='Number of tweets per chunk')
+    parser.add_argument('--progress_interval', type=int, default=10,
+                        help='Seconds between progress reports')
+    parser.add_argument('-l', '--link_sentiment', action='store_true',
+                        help='Follow any link url in tweets and analyze sentiments on web page')
+    parser.add_argument('-w', '--web_sentiment', action='store_true',
+                        help='Get sentiment results from text processing website')
+    parser.add_argument('--override_tokens_required', nargs='+',
+                        help='Override nltk required tokens from config, separate with space')
+    parser.add_argument('--override_tokens_ignored', nargs='+',
+                        help='Override nltk ignored token from config, separate with space')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Run quiet without message output')
+    parser.add_argument('--debug', action='store_true', help='debug message output')
+
+    args = parser.parse_args()
+
+    # set up logging
+    logger = logging.getLogger('stock-tweets')
+    logger.setLevel(logging.INFO)
+
+    logging.addLevelName(logging.INFO, '\033[1;32m%s\033[1;0m'
+                         % logging.getLevelName(logging.INFO))
+    logging.addLevelName(logging.WARNING, '\033[1;31m%s\033[1;0m'
+                         % logging.getLevelName(logging.WARNING))
+    logging.addLevelName(logging.ERROR, '\033[1;41m%s\033[1;0m'
+                         % logging.getLevelName(logging.ERROR))
+    logging.addLevelName(logging.DEBUG, '\033[1;33m%s\033[1;0m'
+                         % logging.getLevelName(logging.DEBUG))
+
+    log_format = '%(asctime)s [%(levelname)s][%(name)s] %(message)s'
+    log_level = logging.INFO
+    logging.basicConfig(format=log_format, level=log_level)
+
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    if args.quiet:
+        logger.disabled = True
+
+    # check if need to override any tokens
+    if args.override_tokens_required:
+        nltk_tokens_required = tuple(args.override_tokens_required)
+    if args.override_tokens_ignored:
+        nltk_tokens_ignored = tuple(args.override_tokens_ignored)
+
+    filenames = []
+    missing = []
+    for pattern in args.files:
+        matches = sorted(glob.glob(pattern))
+        if matches:
+            filenames.extend(matches)
+        else:
+            missing.append(pattern)
+    # fail before indexing anything rather than crash halfway through the job
+    if missing:
+        print('No tweet files found for: %s, exiting' % ', '.join(missing))
+        sys.exit(1)
+
+    # overlapping patterns must not process the same file twice
+    filenames = list(dict.fromkeys(filenames))
+
+    checkpoint = Checkpoint(args.checkpoint, restart=args.restart)
+    todo = [f for f in filenames if not checkpoint.is_done(f)]
+    if len(todo) < len(filenames):
+        logger.warning('Skipping %d files already done in checkpoint %s, use --restart to process them again' % (
+            len(filenames) - len(todo), args.checkpoint))
+
+    # create instance of elasticsearch
+    es = Elasticsearch(hosts=[{'host': elasticsearch_host, 'port': elasticsearch_port}])
+
+    logger.info('NLTK tokens required : %s' % str(nltk_tokens_required))
+    logger.info('NLTK tokens ignored: %s' % str(nltk_tokens_ignored))
+    logger.info('Processing %d files with %d processes (ctrl-c to exit)' % (len(todo), args.processes))
+
+    progress = BatchProgress(total_files=len(todo), interval=args.progress_interval)
+    pool = multiprocessing.Pool(args.processes, initializer=init_worker,
+                                initargs=(nltk_tokens_required, nltk_tokens_ignored, nltk_min_tokens,
+                                          args.web_sentiment, args.link_sentiment,
+                                          args.quiet, args.debug))
+    try:
+        process_files(pool, todo, checkpoint, progress)
+        pool.close()
+        pool.join()
+        progress.report()
+    except KeyboardInterrupt:
+        print('ctrl-c keyboard interrupt, exiting (progress saved to %s)...' % args.checkpoint)
+        pool.terminate()
+        sys.exit(0)
@@ -8,6 +8,10 @@ nltk_tokens_ignored = ("win", 'giveaway')
 nltk_tokens_required = ("jeff", "bezos", "jeff bezos", "#amazon", "@amazon", "amazon", "amzn", "#amzn", "alexa", "blue origin", "space")
 nltk_min_tokens = 1
 
+# tweet link pages, bigger or slower pages are skipped
+link_max_bytes = 2 * 1024 * 1024
+link_timeout = 10
+
 # elasticsearch
 elasticsearch_host = "localhost"
 elasticsearch_port = 9200
@@ -51,127 +51,21 @@ class TweetStreamListener(StreamListener):
             if self.verbose:
                 print('################ tweets: %d | filtered: %d | filtered-ratio: %.2f' % (
                     self.count, self.filtered_count, self.filtered_count / self.count))
+                if args.link_sentiment:
+                    print('################ links: %s' % self.parsing_utils.link_stats_summary())
             logger.debug('tweet data: %s' % str(dict_data))
 
-            text = dict_data['text']
-            if not text:
-                logger.info('Tweet has no text, skipping')
+            doc = self.parsing_utils.tweet_sentiment_analysis(dict_data, link_sentiment=args.link_sentiment)
+            if not doc:
                 self.filtered_count += 1
                 return True
 
-            # extract html links from tweet
-            tweet_urls = []
-            if args.link_sentiment:
-                tweet_urls = re.findall(r'https?://[^\s]+', text)
-
-            # clean up tweet text
-            text_cleaned = self.parsing_utils.clean_text(text)
-
-            if not text_cleaned:
-                logger.info('Tweet does not contain any valid text, skipping')
-                self.filtered_count += 1
-                return True
-
-            # get date when tweet was created
-            created_date = time.strftime('%Y-%m-%dT%H:%M:%S', time.strptime(dict_data['created_at'], 
-            '%a %b %d %H:%M:%S +0000 %Y'))
-
-            # unpack dict_data into separate vars
-            screen_name = str(dict_data.get('user', {}).get('screen_name'))
-            location = str(dict_data.get('user', {}).get('location'))
-            language = str(dict_data.get('user', {}).get('lang'))
-            friends = int(dict_data.get('user', {}).get('friends_count'))
-            followers = int(dict_data.get('user', {}).get('followers_count'))
-            statuses = int(dict_data.get('user', {}).get('statuses_count'))
-            hashtags = str(dict_data.get('entities', {})['hashtags'][0]['text'].title()
-                           ) if len(dict_data.get('entities', {})['hashtags']) > 0 else ""
-            filtered_text = str(text_cleaned)
-            tweet_id = int(dict_data.get('id'))
-            
-            tokens = self.parsing_utils.create_tokens_from_text(filtered_text)
-            
-            # check for min token length
-            if not tokens:
-                logger.info('Empty tokens from tweet, skipping')
-                self.filtered_count += 1
-                return True
-            # check ignored tokens from config
-            for t in nltk_tokens_ignored:
-                if t in tokens:
-                    logger.info('Tweet contains tokens from ignored list, skipping')
-                    self.filtered_count += 1
-                    return True
-            # check required tokens from config
-            tokens_passed = False
-            tokens_found = 0
-            for t in nltk_tokens_required:
-                if t in tokens:
-                    tokens_found += 1
-                    if tokens_found == nltk_min_tokens:
-                        tokens_passed = True
-                        break
-            if not tokens_passed:
-                logger.info('Tweet does not contain tokens from required tokens list or min tokens required, skipping')
-                self.filtered_count += 1
-                return True
-
-            # clean up text for sentiment analysis
-            text_cleaned_for_sentiment = self.parsing_utils.clean_text_sentiment(filtered_text)
-            if not text_cleaned_for_sentiment:
-                logger.info('Tweet does not contain any valid text after cleaning, skipping')
-                self.filtered_count += 1
-
-            if self.verbose:
-                print('Tweet cleaned for sentiment analysis: %s' % text_cleaned_for_sentiment)
-
-            # get sentiment values
-            polarity, subjectivity, sentiment = self.parsing_utils.sentiment_analysis(text_cleaned_for_sentiment)
-
             # add tweet_id to tweet_ids
             self.tweet_ids.append(dict_data['id'])
 
-            # get sentiment for tweet
-            if tweet_urls:
-                tweet_urls_polarity = 0
-                tweet_urls_subjectivity = 0
-                for url in tweet_urls:
-                    res = self.parsing_utils.tweet_link_sentiment_analysis(url)
-                    if not res:
-                        continue
-                    pol, sub, sen = res
-                    tweet_urls_polarity = (tweet_urls_polarity + pol) / 2
-                    tweet_urls_subjectivity = (tweet_urls_subjectivity + sub) / 2
-                    if sentiment == 'positive' or sen == 'positive':
-                        sentiment == 'postive'
-                    elif sentiment == 'negative' or sen == 'negative':
-                        sentiment == 'negative'
-                    else:
-                        sentiment == 'neutral'
-                # calculate average polarity and subjectivity from tweet and tweet links
-                if tweet_urls_polarity > 0:
-                    polarity = (polarity + tweet_urls_polarity) / 2
-                if tweet_urls_subjectivity > 0:
-                    subjectivity = (subjectivity + tweet_urls_subjectivity) / 2
-
             logger.info('Adding tweet to elasticsearch')
             # add twitter data and sentiment info into elasticsearch
-            es.index(index=args.index, 
-            doc_type='tweet', 
-            body={
-                'author': screen_name, 
-                'location': location, 
-                'language': language, 
-                'friends': friends, 
-                'followers': followers, 
-                'statuses': statuses, 
-                'date': created_date, 
-                'message': filtered_text, 
-                'tweet_id': tweet_id, 
-                'polarity': polarity, 
-                'subjectivity': subjectivity, 
-                'sentiment': sentiment, 
-                'hashtags': hashtags
-            })
+            es.index(index=args.index, doc_type='tweet', body=doc)
             return True
 
         except Exception as e:
@@ -242,18 +136,21 @@ if __name__ == '__main__':
     if args.quiet:
         logger.disabled = True
         
-    parsing_utils = ParsingUtils(sentiment_url=sentiment_url, logger=logger, 
-                                 web_sentiment=args.web_sentiment, verbose=args.verbose)
-    
-    # create instance of elasticsearch
-    es = Elasticsearch(hosts=[{'host': elasticsearch_host, 'port': elasticsearch_port}])
-    
     # check if need to override any tokens
     if args.override_tokens_required:
         nltk_tokens_required = tuple(args.override_tokens_required)
     if args.override_tokens_ignored:
         nltk_tokens_ignored = tuple(args.override_tokens_ignored)
 
+    parsing_utils = ParsingUtils(sentiment_url=sentiment_url, logger=logger, 
+                                 web_sentiment=args.web_sentiment, verbose=args.verbose, 
+                                 tokens_required=nltk_tokens_required, 
+                                 tokens_ignored=nltk_tokens_ignored, 
+                                 min_tokens=nltk_min_tokens)
+    
+    # create instance of elasticsearch
+    es = Elasticsearch(hosts=[{'host': elasticsearch_host, 'port': elasticsearch_port}])
+
     # create instance of tweet listener
     tweet_listener = TweetStreamListener(parsing_utils=parsing_utils, verbose=args.verbose)
     
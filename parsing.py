@@ -3,9 +3,11 @@ file - parsing.py
 Implements a utility class that cleans up text and performs sentiment analysis
 """
 
+import collections
 import re
 import requests
 import string
+import time
 import urllib.parse as urlparse
 
 from bs4 import BeautifulSoup
@@ -15,20 +17,31 @@ from textblob import TextBlob
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
 from config import nltk_min_tokens, nltk_tokens_required, nltk_tokens_ignored
+from config import link_max_bytes, link_timeout
+
+# counters kept for each stage of the tweet link pipeline, in pipeline order
+LINK_STAGES = ('links', 'skipped_content_type', 'skipped_size', 'skipped_timeout', 'download_failed', 
+               'downloaded', 'parse_failed', 'skipped_prefilter', 'nlp', 'skipped_keywords', 'analyzed')
 
 class ParsingUtils:
     """
     A utility class that computes sentiment for text
     """
     def __init__(self, sentiment_url, logger, web_sentiment=False, 
-                 verbose=False):
+                 verbose=False, tokens_required=nltk_tokens_required, 
+                 tokens_ignored=nltk_tokens_ignored, min_tokens=nltk_min_tokens):
         """
         sentiment_url: 'http://text-processing.com/api/sentiment/' for online sentiment parsing
+        tokens_required, tokens_ignored, min_tokens: token filters, default to the ones from config
         """
         self.sentiment_url = sentiment_url
         self.logger = logger
         self.web_sentiment = web_sentiment
         self.verbose = verbose
+        self.tokens_required = tokens_required
+        self.tokens_ignored = tokens_ignored
+        self.min_tokens = min_tokens
+        self.link_stats = collections.Counter()
         
     def clean_text(self, text):
         # clean up text
@@ -60,6 +73,23 @@ class ParsingUtils:
         tokens = [w for w in tokens if not len(w) < 3]
         return tokens
 
+    def has_ignored_tokens(self, tokens):
+        # check if any of the ignored tokens is in tokens
+        for t in self.tokens_ignored:
+            if t in tokens:
+                return True
+        return False
+
+    def has_required_tokens(self, tokens):
+        # check if tokens contain at least min_tokens of the required tokens
+        tokens_found = 0
+        for t in self.tokens_required:
+            if t in tokens:
+                tokens_found += 1
+                if tokens_found == self.min_tokens:
+                    return True
+        return False
+
     def get_sentiment_from_url(self, text):
         # get sentiment from text processing website
         payload = {'text': text}
@@ -140,54 +170,259 @@ class ParsingUtils:
 
         return polarity, text_tb.sentiment.subjectivity, sentiment
 
+    def download_link_html(self, url, user_agent):
+        """
+        streaming download of a tweet link page, returns the html or None if the page 
+        is not html, is bigger than link_max_bytes or takes longer than link_timeout seconds
+        """
+        try:
+            with requests.get(url, stream=True, timeout=link_timeout, 
+                              headers={'User-Agent': user_agent}) as req:
+                if not 200 <= req.status_code < 300:
+                    self.logger.info('Got status code %s for tweet link, skipping' % req.status_code)
+                    self.link_stats['download_failed'] += 1
+                    return None
+                content_type = req.headers.get('Content-Type', '')
+                if 'html' not in content_type.lower():
+                    self.logger.info('Tweet link content type %s is not html, skipping' % content_type)
+                    self.link_stats['skipped_content_type'] += 1
+                    return None
+                if int(req.headers.get('Content-Length') or 0) > link_max_bytes:
+                    self.logger.info('Tweet link page is bigger than %d bytes, skipping' % link_max_bytes)
+                    self.link_stats['skipped_size'] += 1
+                    return None
+
+                # the request timeout only limits each socket read, so before every small read 
+                # shrink it to the time left, making link_timeout bound the whole download
+                content = bytearray()
+                deadline = time.time() + link_timeout
+                chunks = req.iter_content(chunk_size=1024)
+                while True:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self.logger.info('Tweet link download took over %d seconds, skipping' % link_timeout)
+                        self.link_stats['skipped_timeout'] += 1
+                        return None
+                    self.set_read_timeout(req, remaining)
+                    try:
+                        chunk = next(chunks)
+                    except StopIteration:
+                        break
+                    except requests.exceptions.ConnectionError:
+                        # requests reports a socket read timeout as ConnectionError, 
+                        # anything raised well before the deadline is a real connection error
+                        if deadline - time.time() > 0.1:
+                            raise
+                        self.logger.info('Tweet link download took over %d seconds, skipping' % link_timeout)
+                        self.link_stats['skipped_timeout'] += 1
+                        return None
+                    content += chunk
+                    if len(content) > link_max_bytes:
+                        self.logger.info('Tweet link page is bigger than %d bytes, skipping' % link_max_bytes)
+                        self.link_stats['skipped_size'] += 1
+                        return None
+                if not content:
+                    self.logger.info('Tweet link page is empty, skipping')
+                    self.link_stats['download_failed'] += 1
+                    return None
+
+                # same as newspaper's own download: requests falls back to ISO-8859-1 when the header 
+                # has no charset, in that case keep the raw bytes so the parser uses the <meta> charset
+                if req.encoding and req.encoding.lower() != 'iso-8859-1':
+                    return bytes(content).decode(req.encoding, errors='replace')
+                return bytes(content)
+        except (requests.exceptions.RequestException, ValueError, LookupError) as e:
+            self.logger.warning('Exception: error downloading tweet link caused by %s' % e)
+            self.link_stats['download_failed'] += 1
+            return None
+
+    def set_read_timeout(self, req, timeout):
+        # set the timeout of the socket a streamed response is read from, no-op once the body is consumed
+        try:
+            req.raw._fp.fp.raw._sock.settimeout(timeout)
+        except (AttributeError, OSError):
+            pass
+
+    def link_text_prefilter(self, text):
+        """
+        cheap check on the raw parsed page text before running keyword extraction and summarization. 
+        Article keywords are words of the title and text, so a page whose words do not contain 
+        the required tokens can never pass the keyword check
+        """
+        text = text.lower()
+        words = set(re.findall(r'\w+', text))
+        words.update(re.sub(r'[^\w ]', '', text).split())
+        return self.has_required_tokens(words)
+
+    def link_stats_summary(self):
+        # one line summary of how much work each link pipeline stage skipped
+        return ' | '.join('%s: %d' % (k, self.link_stats[k]) for k in LINK_STAGES)
+
     def tweet_link_sentiment_analysis(self, url):
         # run sentiment analysis on tweet link text summary page
         try:
             self.logger.info('Following tweet link %s to get sentiment...' % url)
+            self.link_stats['links'] += 1
+            # stage 1: bounded download of html pages only
             article = Article(url)
-            article.download()
+            html = self.download_link_html(url, article.config.browser_user_agent)
+            if not html:
+                return None
+            self.link_stats['downloaded'] += 1
+
+            # stage 2: parse and prefilter on the raw text
+            article.download(input_html=html)
             article.parse()
             if 'Tweet with a location' in article.text:
                 self.logger.info('Link to a twitter web page, skipping')
+                self.link_stats['skipped_prefilter'] += 1
+                return None
+            if not self.link_text_prefilter('%s %s' % (article.title or '', article.text)):
+                self.logger.info('Text does not contain any required token, skipping')
+                self.link_stats['skipped_prefilter'] += 1
                 return None
+
+            # stage 3: keyword extraction and summarization for pages passing the prefilter
             article.nlp()
+            self.link_stats['nlp'] += 1
             tokens = article.keywords
 
             if len(tokens) < 1:
                 self.logger.info('Text does not have min number of tokens, skipping')
+                self.link_stats['skipped_keywords'] += 1
                 return None
-            # check ignored tokens from config
-            for t in nltk_tokens_ignored:
-                if t in tokens:
-                    self.logger.info('Text contains token from ignored list, skipping')
-                    return None
-            # check required tokens from config
-            tokens_passed = False
-            tokens_found = 0
-            for t in nltk_tokens_required:
-                if t in tokens:
-                    tokens_found += 1
-                    if tokens_found == nltk_min_tokens:
-                        tokens_passed = True
-                        break
-            if not tokens_passed:
+            # check ignored tokens
+            if self.has_ignored_tokens(tokens):
+                self.logger.info('Text contains token from ignored list, skipping')
+                self.link_stats['skipped_keywords'] += 1
+                return None
+            # check required tokens
+            if not self.has_required_tokens(tokens):
                 self.logger.info('Text does not contain any required token, skipping')
+                self.link_stats['skipped_keywords'] += 1
                 return None
 
             summary = article.summary
             if not summary:
                 self.logger.info('No text found in tweet link url page')
+                self.link_stats['skipped_keywords'] += 1
                 return None
 
             summary_cleaned = self.clean_text(summary)
             summary_cleaned = self.clean_text_sentiment(summary_cleaned)
             polarity, subjectivity, sentiment = self.sentiment_analysis(summary_cleaned)
+            self.link_stats['analyzed'] += 1
 
             return polarity, subjectivity, sentiment
 
         except ArticleException as e:
             self.logger.warning('Exception: error getting text on twitter link caused by %s' % e)
+            self.link_stats['parse_failed'] += 1
+            return None
+
+    def tweet_sentiment_analysis(self, dict_data, link_sentiment=False):
+        """
+        clean up, filter and run sentiment analysis on a decoded tweet, 
+        returns the document to add to elasticsearch or None if the tweet is filtered out
+        """
+        text = dict_data.get('text')
+        if not text:
+            self.logger.info('Tweet has no text, skipping')
+            return None
+
+        # extract html links from tweet
+        tweet_urls = []
+        if link_sentiment:
+            tweet_urls = re.findall(r'https?://[^\s]+', text)
+
+        # clean up tweet text
+        text_cleaned = self.clean_text(text)
+
+        if not text_cleaned:
+            self.logger.info('Tweet does not contain any valid text, skipping')
+            return None
+
+        # get date when tweet was created
+        created_date = time.strftime('%Y-%m-%dT%H:%M:%S', time.strptime(dict_data['created_at'], 
+        '%a %b %d %H:%M:%S +0000 %Y'))
+
+        # unpack dict_data into separate vars
+        screen_name = str(dict_data.get('user', {}).get('screen_name'))
+        location = str(dict_data.get('user', {}).get('location'))
+        language = str(dict_data.get('user', {}).get('lang'))
+        friends = int(dict_data.get('user', {}).get('friends_count'))
+        followers = int(dict_data.get('user', {}).get('followers_count'))
+        statuses = int(dict_data.get('user', {}).get('statuses_count'))
+        hashtags = str(dict_data.get('entities', {})['hashtags'][0]['text'].title()
+                       ) if len(dict_data.get('entities', {})['hashtags']) > 0 else ""
+        filtered_text = str(text_cleaned)
+        tweet_id = int(dict_data.get('id'))
+
+        tokens = self.create_tokens_from_text(filtered_text)
+
+        # check for min token length
+        if not tokens:
+            self.logger.info('Empty tokens from tweet, skipping')
             return None
+        # check ignored tokens
+        if self.has_ignored_tokens(tokens):
+            self.logger.info('Tweet contains tokens from ignored list, skipping')
+            return None
+        # check required tokens
+        if not self.has_required_tokens(tokens):
+            self.logger.info('Tweet does not contain tokens from required tokens list or min tokens required, skipping')
+            return None
+
+        # clean up text for sentiment analysis
+        text_cleaned_for_sentiment = self.clean_text_sentiment(filtered_text)
+        if not text_cleaned_for_sentiment:
+            self.logger.info('Tweet does not contain any valid text after cleaning, skipping')
+            return None
+
+        if self.verbose:
+            print('Tweet cleaned for sentiment analysis: %s' % text_cleaned_for_sentiment)
+
+        # get sentiment values
+        polarity, subjectivity, sentiment = self.sentiment_analysis(text_cleaned_for_sentiment)
+
+        # get sentiment for tweet links
+        if tweet_urls:
+            tweet_urls_polarity = 0
+            tweet_urls_subjectivity = 0
+            for url in tweet_urls:
+                res = self.tweet_link_sentiment_analysis(url)
+                if not res:
+                    continue
+                pol, sub, sen = res
+                tweet_urls_polarity = (tweet_urls_polarity + pol) / 2
+                tweet_urls_subjectivity = (tweet_urls_subjectivity + sub) / 2
+                if sentiment == 'positive' or sen == 'positive':
+                    sentiment = 'positive'
+                elif sentiment == 'negative' or sen == 'negative':
+                    sentiment = 'negative'
+                else:
+                    sentiment = 'neutral'
+            # calculate average polarity and subjectivity from tweet and tweet links
+            if tweet_urls_polarity > 0:
+                polarity = (polarity + tweet_urls_polarity) / 2
+            if tweet_urls_subjectivity > 0:
+                subjectivity = (subjectivity + tweet_urls_subjectivity) / 2
+
+        return {
+            'author': screen_name, 
+            'location': location, 
+            'language': language, 
+            'friends': friends, 
+            'followers': followers, 
+            'statuses': statuses, 
+            'date': created_date, 
+            'message': filtered_text, 
+            'tweet_id': tweet_id, 
+            'polarity': polarity, 
+            'subjectivity': subjectivity, 
+            'sentiment': sentiment, 
+            'hashtags': hashtags
+        }
 
     def get_twitter_users_from_url(self, url):
         twitter_users = []